@@ -0,0 +1,40 @@
+import os
+import numpy as np
+
+# Shared by the app and the offline scripts so every path normalizes embeddings identically
+
+# embeddings.joblib is the pickled DataFrame written by preprocess_json.py; the .npy and
+# .parquet pair is the memory-mappable store derived from it (rows stay aligned).
+JOBLIB_PATH = "embeddings.joblib"
+EMBEDDINGS_PATH = "embeddings.npy"
+# Half-precision copy for the SimSIMD scan, so that path can be memory-mapped as well
+EMBEDDINGS_F16_PATH = "embeddings_f16.npy"
+METADATA_PATH = "metadata.parquet"
+
+def normalize_rows(matrix):
+    """L2-normalizes each row of a float matrix in place and returns it."""
+    # Row norms are computed once here, so each query only pays for its own norm;
+    # the floor keeps an all-zero row from turning into NaN scores
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.maximum(norms, np.finfo(matrix.dtype).tiny)
+    return matrix
+
+def stack_embeddings(embedding_lists):
+    """Stacks per-chunk embedding lists into one contiguous, L2-normalized float32 matrix."""
+    return normalize_rows(np.ascontiguousarray(np.vstack(embedding_lists), dtype=np.float32))
+
+def save_embedding_store(df):
+    """Writes the normalized matrix and the remaining chunk columns as the memory-mappable store."""
+    embeddings = stack_embeddings(df['embedding'].values)
+    np.save(EMBEDDINGS_PATH, embeddings)
+    np.save(EMBEDDINGS_F16_PATH, embeddings.astype(np.float16))
+    df.drop(columns="embedding").to_parquet(METADATA_PATH, index=False)
+    return embeddings
+
+def store_exists():
+    """True when both files of the memory-mappable store are present."""
+    return os.path.exists(EMBEDDINGS_PATH) and os.path.exists(METADATA_PATH)
+
+def store_is_stale():
+    """True when embeddings.joblib has been regenerated after the store was written."""
+    return os.path.exists(JOBLIB_PATH) and os.path.getmtime(JOBLIB_PATH) > os.path.getmtime(EMBEDDINGS_PATH)
@@ -0,0 +1,10 @@
+import joblib
+from embedding_store import JOBLIB_PATH, save_embedding_store
+
+# One-off conversion of an existing embeddings.joblib into the memory-mappable store
+# that process_incoming.py loads. preprocess_json.py writes the store itself, so this
+# is only needed for knowledge bases built before it did.
+df = joblib.load(JOBLIB_PATH)
+
+embeddings = save_embedding_store(df)
+print(f"Saved {embeddings.shape[0]} embeddings of dimension {embeddings.shape[1]}")
@@ -5,13 +5,22 @@ import numpy as np
 import pandas as pd
 from sklearn.metrics.pairwise import cosine_similarity
 import joblib
+from embedding_store import JOBLIB_PATH, save_embedding_store
+
+# Chunks from every lecture are embedded together, this many texts per request
+BATCH_SIZE = 256
+
+# Reuse one connection for all the batch requests
+session = requests.Session()
 
 def create_embedding(text_list):
     # https://github.com/ollama/ollama/blob/main/docs/api.md#generate-embeddings
-    r = requests.post("http://localhost:11434/api/embed", json={
+    r = session.post("http://127.0.0.1:11434/api/embed", json={
         "model": "bge-m3",
         "input": text_list
-    })
+    }, timeout=300) # A full batch can take minutes on CPU
+    # Fail with Ollama's status here instead of a bare KeyError on 'embeddings' below
+    r.raise_for_status()
 
     embedding = r.json()["embeddings"] 
     return embedding
@@ -24,16 +33,24 @@ chunk_id = 0
 for json_file in jsons:
     with open(f"jsons/{json_file}") as f:
         content = json.load(f)
-    print(f"Creating Embeddings for {json_file}")
-    embeddings = create_embedding([c['text'] for c in content['chunks']])
+    print(f"Loading chunks from {json_file}")
        
-    for i, chunk in enumerate(content['chunks']):
+    for chunk in content['chunks']:
         chunk['chunk_id'] = chunk_id
-        chunk['embedding'] = embeddings[i]
         chunk_id += 1
         my_dicts.append(chunk) 
 
+for start in range(0, len(my_dicts), BATCH_SIZE):
+    batch = my_dicts[start:start + BATCH_SIZE]
+    print(f"Creating Embeddings for chunks {start}-{start + len(batch) - 1} of {len(my_dicts)}")
+    embeddings = create_embedding([c['text'] for c in batch])
+
+    for chunk, embedding in zip(batch, embeddings):
+        chunk['embedding'] = embedding
+
 df = pd.DataFrame.from_records(my_dicts)
 # Save this dataframe
-joblib.dump(df, 'embeddings.joblib')
+joblib.dump(df, JOBLIB_PATH)
+# Also write the memory-mappable store the app prefers, so it never lags behind the joblib file
+save_embedding_store(df)
 
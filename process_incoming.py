@@ -1,13 +1,29 @@
 import streamlit as st
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 import joblib
 import requests
-import json
+import orjson
 import re
 import math
 import os
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from embedding_store import (
+    EMBEDDINGS_F16_PATH, EMBEDDINGS_PATH, JOBLIB_PATH, METADATA_PATH,
+    stack_embeddings, store_exists, store_is_stale,
+)
+
+try:
+    import faiss
+except ImportError:
+    faiss = None # Optional: retrieval falls back to a SimSIMD or NumPy scan
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None # Optional: the brute-force scan falls back to a NumPy matrix-vector product
 
 # --- Configuration & Setup ---
 
@@ -18,21 +34,89 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 
-# Load the embeddings data once per session
+# Minimum seconds between chat bubble re-renders while tokens stream in
+STREAM_RENDER_INTERVAL = 0.04
+
+# Use the loopback address directly to skip hostname resolution on every call
+OLLAMA_URL = "http://127.0.0.1:11434"
+
+def get_ollama_session():
+    """Returns this browser session's HTTP session for the local Ollama API."""
+    # Kept across reruns so Ollama calls reuse keep-alive connections. requests.Session is not
+    # documented as thread-safe, so each browser session gets its own rather than sharing one
+    # app-wide; a browser session's script runs never overlap.
+    if "ollama_session" not in st.session_state:
+        st.session_state.ollama_session = requests.Session()
+    return st.session_state.ollama_session
+
+# Runs fire-and-forget Ollama calls off the script thread
 @st.cache_resource
-def load_rag_assets():
-    """Loads the pre-processed embeddings data."""
-    try:
-        # NOTE: Ensure 'embeddings.joblib' is in the same directory as this script.
-        return joblib.load('embeddings.joblib')
-    except FileNotFoundError:
-        st.error("Error: 'embeddings.joblib' file not found. Please run your preprocessing script.")
+def get_background_executor():
+    """Returns the shared single-thread worker for background Ollama requests."""
+    return ThreadPoolExecutor(max_workers=1)
+
+# Only the single background worker thread uses this session, so it is never shared between threads
+@st.cache_resource
+def get_background_session():
+    """Returns the HTTP session used by background Ollama requests."""
+    return requests.Session()
+
+def build_search_index(embeddings):
+    """Builds an exact inner-product FAISS index over the normalized embeddings, if FAISS is installed."""
+    if faiss is None:
         return None
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(embeddings)
+    return index
 
-df = load_rag_assets()
+# Load the embeddings data once per session
+@st.cache_resource
+def load_rag_assets():
+    """Loads the pre-processed chunk records and their L2-normalized embedding matrix."""
+    use_store = store_exists()
+    if use_store and store_is_stale():
+        st.warning(f"'{JOBLIB_PATH}' is newer than '{EMBEDDINGS_PATH}', so it is loaded instead. Run migrate_embeddings.py to refresh the store.")
+        use_store = False
+
+    # SimSIMD scans in half precision; FAISS and the NumPy fallback use float32
+    use_half_precision = faiss is None and simsimd is not None
+
+    if use_store:
+        # Memory-map the already-normalized matrix: nothing is unpickled, and for the NumPy
+        # and SimSIMD scans the OS page cache shares a single copy across Streamlit processes.
+        # FAISS copies the matrix into its own index, so that path gains only the faster load.
+        if use_half_precision and os.path.exists(EMBEDDINGS_F16_PATH):
+            embeddings = np.load(EMBEDDINGS_F16_PATH, mmap_mode="r")
+        else:
+            embeddings = np.load(EMBEDDINGS_PATH, mmap_mode="r")
+        df = pd.read_parquet(METADATA_PATH)
+    else:
+        try:
+            # NOTE: Ensure 'embeddings.joblib' is in the same directory as this script.
+            df = joblib.load(JOBLIB_PATH)
+        except FileNotFoundError:
+            st.error(f"Error: '{JOBLIB_PATH}' file not found. Please run your preprocessing script.")
+            return None, None, None
+
+        # Stack the per-row embedding lists into one contiguous float32 matrix once,
+        # so each query is a single matrix-vector product instead of a re-stack.
+        embeddings = stack_embeddings(df['embedding'].values)
+
+    # Keep only the prompt fields as plain dicts so queries skip a pandas round-trip
+    records = df[["number", "title", "start", "text"]].to_dict("records")
+
+    search_index = build_search_index(embeddings)
+    if use_half_precision and embeddings.dtype != np.float16:
+        # SimSIMD has native half-precision kernels, so the scan can stream half the bytes.
+        # This is a private in-RAM copy; only the float16 store file is shared via mmap.
+        embeddings = embeddings.astype(np.float16)
+    return records, embeddings, search_index
+
+records, embeddings, search_index = load_rag_assets()
 
 # --- Utility Functions ---
 
+@functools.lru_cache(maxsize=256)
 def format_seconds_to_mm_ss(seconds):
     """Converts a time in total seconds (float/str) to MM:SS format."""
     try:
@@ -45,49 +129,84 @@ def format_seconds_to_mm_ss(seconds):
 
 def create_embedding(text_list):
     """Generates embeddings via the local Ollama API."""
+    r = get_ollama_session().post(f"{OLLAMA_URL}/api/embed", json={
+        "model": "bge-m3",
+        "input": text_list
+    }, timeout=10)
+    r.raise_for_status()
+    return r.json()["embeddings"]
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def create_query_embedding(text):
+    """Embeds a single question, reusing cached results for repeated questions.
+
+    Connection errors propagate instead of returning None, so failures are never cached.
+    """
+    return create_embedding([text])[0]
+
+def preload_llm(session, ollama_model="llama3.2"):
+    """Asks Ollama to load the LLM into memory without generating anything.
+
+    Runs on the background worker, which has no Streamlit script context, so the
+    session is fetched on the script thread and passed in.
+    """
     try:
-        r = requests.post("http://localhost:11434/api/embed", json={
-            "model": "bge-m3",
-            "input": text_list
-        }, timeout=10)
-        r.raise_for_status()
-        return r.json()["embeddings"]
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error connecting to Ollama embedding service: {e}")
-        return None
+        session.post(f"{OLLAMA_URL}/api/generate", json={
+            "model": ollama_model
+        }, timeout=120)
+    except requests.exceptions.RequestException:
+        pass # The streaming request below reports connection problems
+
+def iter_json_lines(response, chunk_size=4096):
+    """Parses a newline-delimited JSON stream straight from raw byte chunks."""
+    buffer = bytearray()
+    for data in response.iter_content(chunk_size=chunk_size):
+        buffer += data
+        start = 0
+        while (newline := buffer.find(b"\n", start)) != -1:
+            line = buffer[start:newline]
+            start = newline + 1
+            if line.strip():
+                try:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+        # Keep only the trailing partial line for the next chunk
+        del buffer[:start]
+
+    if buffer.strip():
+        try:
+            yield orjson.loads(buffer)
+        except orjson.JSONDecodeError:
+            pass
+
+class OllamaConnectionError(Exception):
+    """Raised with a user-facing message when a request to Ollama fails."""
 
 def generate_streaming_response(prompt, ollama_model="llama3.2"):
-    """Streams the LLM response from Ollama API."""
+    """Streams the LLM response from Ollama API; raises OllamaConnectionError if it fails."""
     try:
-        r = requests.post("http://localhost:11434/api/generate", json={
+        with get_ollama_session().post(f"{OLLAMA_URL}/api/generate", json={
             "model": ollama_model,
             "prompt": prompt,
             "stream": True
-        }, stream=True, timeout=120)
-        r.raise_for_status()
-
-        full_response = ""
-        for chunk in r.iter_lines():
-            if chunk:
-                try:
-                    data = json.loads(chunk)
-                    response_text = data.get("response", "")
-                    full_response += response_text
-                    yield response_text
-                    if data.get("done"):
-                        break
-                except json.JSONDecodeError:
-                    continue
+        }, stream=True, timeout=120) as r:
+            r.raise_for_status()
+
+            # Read to the end of the stream (Ollama closes it right after the "done" object)
+            # so the connection returns to the keep-alive pool instead of being dropped
+            full_response = ""
+            for data in iter_json_lines(r):
+                response_text = data.get("response", "")
+                full_response += response_text
+                yield response_text
         return full_response
     except requests.exceptions.RequestException as e:
-        st.error(f"Error connecting to LLM: Is Ollama running? Details: {e}")
-        return "Error: Could not connect to LLM."
+        raise OllamaConnectionError(f"Error connecting to LLM: Is Ollama running? Details: {e}") from e
 
 
-def get_final_prompt(incoming_query, context_json):
-    """Constructs the final RAG system prompt with strict instructions."""
-    
-    prompt_template = f'''
+# The static instructions are built once; only the context and question vary per query
+PROMPT_PREAMBLE = '''
 You are **AIKARA**, a highly precise, professional AI Teaching Assistant specialized in the current video lecture material (Fuzzy Logic, Interface, and ML Techniques).
 
 **YOUR CORE INSTRUCTIONS:**
@@ -99,26 +218,33 @@ You are **AIKARA**, a highly precise, professional AI Teaching Assistant special
 
 **VIDEO SUBTITLE CONTEXT (For your use only):**
 ---
-{context_json}
+'''
+PROMPT_SUFFIX = '''
 ---
 **USER QUESTION:** "{incoming_query}"
 
 **AIKARA RESPONSE (Start immediately with the answer):**
 '''
-    return prompt_template
+
+def get_final_prompt(incoming_query, context_json):
+    """Constructs the final RAG system prompt with strict instructions."""
+    return PROMPT_PREAMBLE + context_json + PROMPT_SUFFIX.format(incoming_query=incoming_query)
+
+# Compiled once at import so each response skips pattern parsing
+# Matches the format [Fuzzy Set, 417.68] or [Lecture 2, 417.68]
+# Capture Groups: (1: Title/Number) (2: Time in Seconds)
+CITATION_PATTERN = re.compile(r"\[\s*([^,\[\]]+),\s*([\d\.]+)\s*\]", re.IGNORECASE)
+BRACKETED_TEXT_PATTERN = re.compile(r"\[.*?\]")
+PADDING_PATTERN = re.compile(r"^(A fuzzy set is a mathematical concept used to represent uncertainty or imprecision in variables\s*)\.")
 
 def cleanup_and_format_output(full_response_text):
     """Extracts citation, converts time, and cleans answer text."""
-    
-    # NEW REGEX: Matches the format [Fuzzy Set, 417.68] or [Lecture 2, 417.68]
-    # Capture Groups: (1: Title/Number) (2: Time in Seconds)
-    CITATION_PATTERN = r"\[\s*([^,\[\]]+),\s*([\d\.]+)\s*\]" 
 
     clean_answer = full_response_text.strip()
     citation = "Source: General Knowledge / Uncited"
 
     # Find the citation
-    match = re.search(CITATION_PATTERN, full_response_text, flags=re.IGNORECASE)
+    match = CITATION_PATTERN.search(full_response_text)
 
     if match:
         lecture_title_or_num = match.group(1).strip()
@@ -131,32 +257,58 @@ def cleanup_and_format_output(full_response_text):
         citation = f"Source: {lecture_title_or_num} | Time: {time_mm_ss} ({time_seconds}s)"
         
         # Remove all bracketed text (including citations and hallucinations) from the answer
-        clean_answer = re.sub(r"\[.*?\]", '', full_response_text).strip()
+        clean_answer = BRACKETED_TEXT_PATTERN.sub('', full_response_text).strip()
         
         # Remove multi-line streaming artifacts and leading/trailing whitespace
         clean_answer = clean_answer.replace("\n", " ").strip()
         
         # FINAL SANITIZATION: Remove known conversational padding LLMs sometimes force
-        clean_answer = re.sub(r"^(A fuzzy set is a mathematical concept used to represent uncertainty or imprecision in variables\s*)\.", "", clean_answer).strip()
+        clean_answer = PADDING_PATTERN.sub("", clean_answer).strip()
 
     return clean_answer, citation
 
-def process_and_stream_rag(incoming_query, df):
+def search_similar_chunks(question_embedding, embeddings, search_index, top_results=5):
+    """Returns the row indices of the most similar chunks, best match first."""
+    top_results = min(top_results, len(embeddings))
+
+    if search_index is not None:
+        _, indices = search_index.search(question_embedding[None, :], top_results)
+        return indices[0]
+
+    if simsimd is not None:
+        # SimSIMD returns cosine distances; convert them back to similarities
+        query = question_embedding.astype(embeddings.dtype)
+        distances = simsimd.cdist(query[None, :], embeddings, metric="cosine")
+        similarities = 1 - np.asarray(distances).ravel()
+    else:
+        similarities = embeddings @ question_embedding
+
+    # Select the top rows in linear time, then sort only those few by score
+    top_indx = np.argpartition(similarities, -top_results)[-top_results:]
+    return top_indx[np.argsort(similarities[top_indx])[::-1]]
+
+def process_and_stream_rag(incoming_query, records, embeddings, search_index):
     """Executes the full RAG pipeline and streams the output."""
     
-    # 1. RAG Retrieval
-    question_embedding = create_embedding([incoming_query])
-    if question_embedding is None:
-        return "Error: Could not generate embedding."
+    # 1. RAG Retrieval, while Ollama loads the LLM for step 3 in the background
+    # (once per browser session; afterwards the model is normally already resident)
+    if not st.session_state.get("llm_preloaded"):
+        get_background_executor().submit(preload_llm, get_background_session())
+        st.session_state.llm_preloaded = True
+    try:
+        question_embedding = create_query_embedding(incoming_query)
+    except requests.exceptions.RequestException as e:
+        raise OllamaConnectionError(f"Error connecting to Ollama embedding service: {e}") from e
         
-    question_embedding = question_embedding[0]
+    # Rows are pre-normalized, so normalizing the query makes a dot product the cosine similarity
+    question_embedding = np.asarray(question_embedding, dtype=np.float32)
+    question_norm = np.sqrt(np.vdot(question_embedding, question_embedding))
+    if question_norm > 0:
+        question_embedding /= question_norm
     
-    similarities = cosine_similarity(np.vstack(df['embedding']), [question_embedding]).flatten()
-    top_results = 5
-    max_indx = similarities.argsort()[::-1][0:top_results]
-    new_df = df.loc[max_indx] 
-    
-    context_json = new_df[["number", "title", "start", "text"]].to_json(orient="records")
+    max_indx = search_similar_chunks(question_embedding, embeddings, search_index)
+    context_records = [records[i] for i in max_indx]
+    context_json = orjson.dumps(context_records, option=orjson.OPT_SERIALIZE_NUMPY).decode()
 
     # 2. Create the prompt
     final_prompt = get_final_prompt(incoming_query, context_json)
@@ -241,53 +393,94 @@ st.markdown("""
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-# Display chat messages from history
-for message in st.session_state.messages:
+def render_message(message):
+    """Renders one saved chat message, with its source line under assistant answers."""
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        if message.get("error"):
+            # Keep connection failures visible when the turn is redrawn from history
+            st.error(message["error"])
         if message["role"] == "assistant":
             # Display source line below the AI bubble
             st.markdown(f'<p class="source-citation">{message["source"]}</p>', unsafe_allow_html=True)
 
+# Finished turns live in this container, outside the fragment below. A full rerun redraws
+# them from history; the fragment appends each new turn here once, so a new question
+# never re-renders the earlier conversation.
+chat_history = st.container()
+with chat_history:
+    for message in st.session_state.messages:
+        render_message(message)
 
-# --- Chat Input & RAG Execution ---
 
-if prompt := st.chat_input("Ask AIKARA a question (English or Hindi)..."):
-    
-    # 1. Display User Message
-    with st.chat_message("user"):
-        st.markdown(prompt)
-    st.session_state.messages.append({"role": "user", "content": prompt})
-
-    # 2. Prepare AI Response container for streaming
-    with st.chat_message("assistant"):
-        message_placeholder = st.empty()
-        full_response_text = ""
-        
-        # Execute RAG and stream output
-        stream_generator = process_and_stream_rag(prompt, df)
-        
-        for chunk in stream_generator:
-            full_response_text += chunk
-            # Update the placeholder with the accumulating response text
-            message_placeholder.markdown(full_response_text + "▌") # Use '▌' as a cursor
-        
-        # Remove cursor and finalize the text
-        message_placeholder.markdown(full_response_text)
-        
-        # 3. Cleanup and Format
-        clean_answer, citation = cleanup_and_format_output(full_response_text)
-        
-        # Overwrite the streamed placeholder with the final, clean answer
-        message_placeholder.markdown(clean_answer)
-        
-        # Display the source below the main chat bubble
-        st.markdown(f'<p class="source-citation">{citation}</p>', unsafe_allow_html=True)
-        
+# --- Chat Input & RAG Execution ---
 
-    # 4. Save Final Output to History
-    st.session_state.messages.append({
-        "role": "assistant", 
-        "content": clean_answer, 
-        "source": citation
-    })
\ No newline at end of file
+@st.fragment
+def chat_turn():
+    """Answers one question; submitting a question reruns only this fragment."""
+    # Inside a fragment Streamlit renders st.chat_input inline; the .stChatInput CSS above
+    # is what keeps it pinned to the bottom of the page.
+    if prompt := st.chat_input("Ask AIKARA a question (English or Hindi)..."):
+        # The in-flight turn is drawn here and moved into chat_history once it is finished
+        current_turn = st.empty()
+        with current_turn.container():
+            
+            # 1. Display User Message
+            with st.chat_message("user"):
+                st.markdown(prompt)
+            user_message = {"role": "user", "content": prompt}
+            st.session_state.messages.append(user_message)
+
+            # 2. Prepare AI Response container for streaming
+            with st.chat_message("assistant"):
+                message_placeholder = st.empty()
+                full_response_text = ""
+            
+                # Execute RAG and stream output
+                error = None
+                try:
+                    stream_generator = process_and_stream_rag(prompt, records, embeddings, search_index)
+                
+                    last_render = 0.0
+                    for chunk in stream_generator:
+                        full_response_text += chunk
+                        # Update the placeholder at most every STREAM_RENDER_INTERVAL seconds, not per token
+                        now = time.monotonic()
+                        if now - last_render > STREAM_RENDER_INTERVAL:
+                            message_placeholder.markdown(full_response_text + "▌") # Use '▌' as a cursor
+                            last_render = now
+                except OllamaConnectionError as e:
+                    # Saved with the turn below, so the error survives the move into chat_history
+                    error = str(e)
+                    st.error(error)
+            
+                # Remove cursor and finalize the text
+                message_placeholder.markdown(full_response_text)
+            
+                # 3. Cleanup and Format
+                clean_answer, citation = cleanup_and_format_output(full_response_text)
+            
+                # Overwrite the streamed placeholder with the final, clean answer
+                message_placeholder.markdown(clean_answer)
+            
+                # Display the source below the main chat bubble
+                st.markdown(f'<p class="source-citation">{citation}</p>', unsafe_allow_html=True)
+            
+
+        # 4. Save Final Output to History
+        assistant_message = {
+            "role": "assistant", 
+            "content": clean_answer, 
+            "source": citation,
+            "error": error
+        }
+        st.session_state.messages.append(assistant_message)
+
+        # 5. Move the finished turn into the history container, where it stays until the
+        # next full rerun, and clear it from the fragment so the next rerun starts empty
+        current_turn.empty()
+        with chat_history:
+            render_message(user_message)
+            render_message(assistant_message)
+
+chat_turn()
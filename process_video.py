@@ -1,5 +1,7 @@
 import os
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 # Converts the videos to mp3
 videos_dir = "videos"
@@ -15,49 +17,99 @@ except FileNotFoundError:
     print(f"Error: The directory '{videos_dir}' was not found.")
     files = []
 
-for file in files:
+def probe_audio_codec(input_path):
+    """Returns the codec name of the first audio stream (e.g. 'aac'), or None if it can't be read."""
+    command = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        input_path
+    ]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    return result.stdout.strip() or None
+
+def convert(file):
+    """Extracts the audio of a single video in the videos directory into the audios directory."""
     # Ensure we only process files (not directories) and skip the script itself
-    if os.path.isfile(os.path.join(videos_dir, file)):
-        # Assumes filenames are simple like 'Lecture 2.mkv' and you want 'Lecture 2' as the name
-        # The original code's complex splitting logic caused the IndexError.
-        
-        file_name_without_ext, ext = os.path.splitext(file)
+    if not os.path.isfile(os.path.join(videos_dir, file)):
+        return
+
+    # Assumes filenames are simple like 'Lecture 2.mkv' and you want 'Lecture 2' as the name
+    # The original code's complex splitting logic caused the IndexError.
+    
+    file_name_without_ext, ext = os.path.splitext(file)
+    
+    # If the file names are 'Lecture X.mkv', a simple approach to get the number 'X'
+    try:
+        # Example: from 'Lecture 2', get '2'
+        tutorial_number = file_name_without_ext.split(' ')[1] 
+    except IndexError:
+        # Fallback if the name doesn't contain a space
+        tutorial_number = file_name_without_ext
         
-        # If the file names are 'Lecture X.mkv', a simple approach to get the number 'X'
-        try:
-            # Example: from 'Lecture 2', get '2'
-            tutorial_number = file_name_without_ext.split(' ')[1] 
-        except IndexError:
-            # Fallback if the name doesn't contain a space
-            tutorial_number = file_name_without_ext
-            
-        file_name = file_name_without_ext
-
-        print(f"Processing: {file}")
-        print(f"  Tutorial Number: {tutorial_number}, File Name: {file_name}")
-
-        # The f-string must be properly quoted for shell execution
-        # Use a list of arguments for better security and handling of spaces in names
-        input_path = os.path.join(videos_dir, file)
-        output_path = os.path.join(audios_dir, f"{tutorial_number}_{file_name}.mp3")
+    file_name = file_name_without_ext
+
+    # Each message is a single print call so lines from parallel workers don't interleave
+    print(f"Processing: {file} (Tutorial Number: {tutorial_number}, File Name: {file_name})")
+
+    # The f-string must be properly quoted for shell execution
+    # Use a list of arguments for better security and handling of spaces in names
+    input_path = os.path.join(videos_dir, file)
+    output_base = os.path.join(audios_dir, f"{tutorial_number}_{file_name}")
 
+    # Skip files whose audio (copied .m4a or encoded .mp3) is already newer than the source video
+    for audio_ext in (".mp3", ".m4a"):
+        existing_path = output_base + audio_ext
+        if os.path.exists(existing_path) and os.path.getmtime(existing_path) >= os.path.getmtime(input_path):
+            print(f"  Skipping {file}: '{existing_path}' is up to date.")
+            return
+
+    audio_codec = probe_audio_codec(input_path)
+    if audio_codec in ("mp3", "aac"):
+        # The audio is already compressed: remux it as-is instead of decoding and re-encoding
+        output_path = output_base + (".mp3" if audio_codec == "mp3" else ".m4a")
+        audio_args = ["-c:a", "copy"]
+    else:
         # The command uses ffmpeg to convert video to mp3 (audio only)
-        command = [
-            "ffmpeg",
-            "-i", input_path,
-            "-vn", # Disable video recording
+        output_path = output_base + ".mp3"
+        audio_args = [
             "-acodec", "libmp3lame", # Use libmp3lame for MP3 encoding
-            "-q:a", "2", # Variable bitrate quality (2 is high quality)
-            output_path
+            "-q:a", "4", # Variable bitrate quality (4 is plenty for lecture speech)
         ]
-        
-        try:
-            # Execute the ffmpeg command
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            print("  Conversion successful.")
-        except subprocess.CalledProcessError as e:
-            print(f"  Conversion failed for {file}. Error:")
-            print(e.stderr)
-        except FileNotFoundError:
-            print("  Error: 'ffmpeg' command not found. Please ensure ffmpeg is installed and in your system's PATH.")
-            break # Stop processing if ffmpeg isn't found
\ No newline at end of file
+
+    command = [
+        "ffmpeg",
+        "-y", # Overwrite stale outputs instead of prompting
+        "-i", input_path,
+        "-vn", # Disable video recording
+        *audio_args,
+        "-threads", "1", # Parallelism comes from running one ffmpeg per file
+        output_path
+    ]
+    
+    try:
+        # Execute the ffmpeg command
+        subprocess.run(command, check=True, capture_output=True, text=True)
+        # Remove an older output with the other extension (e.g. a previous .mp3 when the
+        # audio is now copied to .m4a), so create_chunks.py doesn't transcribe the lecture twice
+        for audio_ext in (".mp3", ".m4a"):
+            stale_path = output_base + audio_ext
+            if stale_path != output_path and os.path.exists(stale_path):
+                os.remove(stale_path)
+        print(f"  Conversion successful for {file}.")
+    except subprocess.CalledProcessError as e:
+        print(f"  Conversion failed for {file}. Error:\n{e.stderr}")
+
+
+# Check for ffmpeg once up front rather than failing inside every worker
+if files and shutil.which("ffmpeg") is None:
+    print("Error: 'ffmpeg' command not found. Please ensure ffmpeg is installed and in your system's PATH.")
+elif files:
+    # Each ffmpeg runs as its own process, so threads are enough to keep every core busy
+    with ThreadPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1)) as executor:
+        list(executor.map(convert, files))